@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Compares the response parsing layer against decoding via resp.text.
+
+The fixtures in instagram_scraper/tests/fixtures are scaled up to the sizes of
+real responses: a ~1 MB profile page and media pages of a few hundred items.
+
+    $ python benchmarks/benchmark_parsing.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+# Run against the checkout rather than an installed copy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from instagram_scraper import parsing
+
+FIXTURES = os.path.join(os.path.dirname(__file__), '..', 'instagram_scraper', 'tests', 'fixtures')
+REPEAT = 5
+NUMBER = 20
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name + '.json'), 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def profile_page(padding_bytes=1024 * 1024):
+    """A profile page with the shared data blob placed after a large html head, as served by instagram."""
+    head = b'<html><head>' + b'<link rel="preload" href="/static/bundles/x.js" as="script">' * (padding_bytes // 60)
+    shared_data = json.dumps(load_fixture('response_user_metadata')).encode('utf-8')
+    tail = b'<script>window.__additionalData = {};</script>' * 1000
+    return head + b'<script type="text/javascript">window._sharedData = ' + shared_data + b';</script>' + tail
+
+
+def media_page(items=500):
+    page = load_fixture('response_first_page')
+    page['items'] = (page['items'] * (items // len(page['items']) + 1))[:items]
+    return json.dumps(page, indent=2).encode('utf-8')
+
+
+def hashtag_page(nodes=500):
+    page = load_fixture('response_query_hashtag_first_page')
+    page['media']['nodes'] = (page['media']['nodes'] * (nodes // len(page['media']['nodes']) + 1))[:nodes]
+    return json.dumps(page, indent=2).encode('utf-8')
+
+
+def chunked(content, size=parsing.SHARED_DATA_CHUNK_SIZE):
+    return (content[i:i + size] for i in range(0, len(content), size))
+
+
+def text_split(content):
+    text = content.decode('utf-8')
+    if '_sharedData' in text:
+        return json.loads(text.split("window._sharedData = ")[1].split(";</script>")[0])
+
+
+def text_loads(content):
+    return json.loads(content.decode('utf-8'))
+
+
+def bench(label, fn, content):
+    best = min(timeit.repeat(lambda: fn(content), repeat=REPEAT, number=NUMBER)) / NUMBER
+    print('{0:<40} {1:>10.3f} ms'.format(label, best * 1000))
+
+
+def main():
+    print('json backend: {0}'.format(parsing.json_backend.__name__))
+
+    content = profile_page()
+    assert text_split(content) == parsing.find_shared_data(chunked(content))
+    print('\nprofile page ({0} KB)'.format(len(content) // 1024))
+    bench('text + split + json.loads', text_split, content)
+    bench('parsing.find_shared_data', lambda c: parsing.find_shared_data(chunked(c)), content)
+
+    for name, content in (('media page', media_page()), ('hashtag query page', hashtag_page())):
+        print('\n{0} ({1} KB)'.format(name, len(content) // 1024))
+        bench('json.loads(resp.text)', text_loads, content)
+        bench('parsing.loads(resp.content)', parsing.loads, content)
+
+
+if __name__ == '__main__':
+    main()
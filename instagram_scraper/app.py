@@ -4,13 +4,13 @@
 import argparse
 import codecs
 import errno
-import glob
 import json
 import logging.config
 import os
 import re
 import sys
 import textwrap
+import threading
 import time
 import warnings
 
@@ -18,8 +18,16 @@ import concurrent.futures
 import requests
 import tqdm
 
+from instagram_scraper import parsing
+from instagram_scraper.sessions import Account, SessionPool
+from instagram_scraper.tracing import Tracer
 from instagram_scraper.constants import *
 
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir  # Python < 3.5
+
 try:
     reload(sys)  # Python 2.7
     sys.setdefaultencoding("UTF8")
@@ -29,11 +37,124 @@ except NameError:
 warnings.filterwarnings('ignore')
 
 
+class MediaItem(object):
+    """Compact record of the fields the download pipeline needs from a media item."""
+    __slots__ = ('id', 'type', 'types', 'urls', 'timestamp', 'tags', 'raw')
+
+    def __init__(self, id=None, type=None, types=(), urls=(), timestamp=None, tags=(), raw=None):
+        self.id = id
+        self.type = type
+        self.types = tuple(types) or ((type,) if type else ())
+        self.urls = tuple(urls)
+        self.timestamp = timestamp
+        self.tags = tuple(tags)
+        self.raw = raw
+
+    @classmethod
+    def from_raw(cls, item, timestamp_key, keep_raw=False):
+        """Builds a record from a raw API item, keeping the raw item only if requested."""
+        if 'type' in item:
+            media_type = item['type']
+        else:
+            media_type = 'video' if item.get('is_video') else 'image'
+
+        if media_type == 'carousel':
+            types = [carousel_item['type'] for carousel_item in item['carousel_media']]
+        else:
+            types = [media_type]
+
+        return cls(id=item.get('id'), type=media_type, types=types, urls=item.get('urls', ()),
+                   timestamp=item.get(timestamp_key), tags=item.get('tags', ()),
+                   raw=item if keep_raw else None)
+
+
+class JsonStreamWriter(object):
+    """Writes a json array to a file one element at a time."""
+    def __init__(self, dst):
+        self.dst = dst
+        self.file = None
+        self.writer = None
+
+    def write(self, data):
+        if self.file is None:
+            self.file = open(self.dst, 'wb')
+            self.writer = codecs.getwriter('utf-8')(self.file)
+            self.writer.write('[\n')
+        else:
+            self.writer.write(',\n')
+
+        # Indent each element so the output matches json.dump(..., indent=4) of the whole list
+        element = json.dumps(data, indent=4, sort_keys=True, ensure_ascii=False)
+        self.writer.write('\n'.join('    ' + line for line in element.split('\n')))
+
+    def close(self):
+        if self.file is not None:
+            self.writer.write('\n]')
+            self.file.close()
+            self.file = None
+
+
+class DirectoryIndex(object):
+    """In-memory index of the files in a directory.
+
+    The scan only reads names, which needs no stat call on most filesystems. Sizes and mtimes are known for files
+    added during the run, and are read on demand for the others.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.scan()
+
+    def scan(self):
+        """Reads the directory contents in a single pass."""
+        entries = {}
+        try:
+            for entry in scandir(self.path):
+                if entry.is_file():
+                    entries[entry.name] = None
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+        with self.lock:
+            self.entries = entries
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def add(self, name, size, mtime):
+        """Records a file written to the directory."""
+        with self.lock:
+            self.entries[name] = (size, mtime)
+
+    def latest_mtime(self, extensions):
+        """Returns the newest mtime among files with the given extensions, or None."""
+        with self.lock:
+            entries = [(name, info) for name, info in self.entries.items() if name.endswith(extensions)]
+
+        mtimes = []
+        for name, info in entries:
+            if info is None:
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                info = (stat.st_size, stat.st_mtime)
+                with self.lock:
+                    if self.entries.get(name) is None:
+                        self.entries[name] = info
+            mtimes.append(info[1])
+
+        return max(mtimes) if mtimes else None
+
+
 class InstagramScraper(object):
     """InstagramScraper scrapes and downloads an instagram user's photos and videos"""
     def __init__(self, **kwargs):
         default_attr = dict(username='', usernames=[], filename=None,
-                            login_user=None, login_pass=None,
+                            login_user=None, login_pass=None, credentials_file=None, segments=DOWNLOAD_SEGMENTS,
+                            trace=None, profile=False,
                             destination='./', retain_username=False,
                             quiet=False, maximum=0, media_metadata=False, latest=False,
                             media_types=['image', 'video', 'story'], tag=False)
@@ -43,44 +164,57 @@ class InstagramScraper(object):
 
         for key in default_attr:
             if key in allowed_attr:
-                self.__dict__[key] = kwargs.get(key)
+                self.__dict__[key] = default_attr.get(key)
 
         # Set up a file logger
         self.logger = InstagramScraper.get_logger(level=logging.WARN)
+        self.tracer = Tracer(self.trace, self.profile)
 
-        self.posts = []
         self.session = requests.Session()
-        self.cookies = None
+        self.accounts = None
         self.logged_in = False
         self.last_scraped_filemtime = 0
+        self.dir_indexes = {}
+        self.dir_indexes_lock = threading.Lock()
 
-    def login(self):
-        """Logs in to instagram."""
-        self.session.headers.update({'Referer': BASE_URL})
-        req = self.session.get(BASE_URL)
-
-        self.session.headers.update({'X-CSRFToken': req.cookies['csrftoken']})
+        # Every connection a download opens, including the extra segments of large files, takes a slot
+        self.connection_slots = threading.BoundedSemaphore(MAX_CONCURRENT_DOWNLOADS)
+        self.segment_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS)
+        self.segment_min_size = SEGMENTED_DOWNLOAD_MIN_SIZE
 
-        login_data = {'username': self.login_user, 'password': self.login_pass}
-        login = self.session.post(LOGIN_URL, data=login_data, allow_redirects=True)
-        self.session.headers.update({'X-CSRFToken': login.cookies['csrftoken']})
-        self.cookies = login.cookies
+    def login(self):
+        """Logs in to instagram with every configured account."""
+        credentials = []
+        if self.credentials_file:
+            credentials.extend(self.parse_credentials_file(self.credentials_file))
+        if self.login_user and self.login_pass:
+            credentials.append((self.login_user, self.login_pass))
 
-        if login.status_code == 200 and json.loads(login.text)['authenticated']:
-            self.logged_in = True
-        else:
-            self.logger.exception('Login failed for ' + self.login_user)
-            raise ValueError('Login failed for ' + self.login_user)
+        self.accounts = SessionPool([Account(user, password) for user, password in credentials], self.logger)
+        with self.tracer.span('login', accounts=len(self.accounts.accounts)):
+            self.accounts.login()
+        self.logged_in = True
 
     def logout(self):
         """Logs out of instagram."""
         if self.logged_in:
-            try:
-                logout_data = {'csrfmiddlewaretoken': self.cookies['csrftoken']}
-                self.session.post(LOGOUT_URL, data=logout_data)
-                self.logged_in = False
-            except requests.exceptions.RequestException:
-                self.logger.warning('Failed to log out ' + self.login_user)
+            self.accounts.logout()
+            self.logged_in = False
+
+    def get(self, url, url_class='request', account_headers=None, **kwargs):
+        """Sends a GET request, through the account pool when logged in."""
+        with self.tracer.span(url_class, 'request', url=url) as span:
+            if self.logged_in:
+                resp = self.accounts.request('GET', url, account_headers=account_headers, span=span, **kwargs)
+            else:
+                resp = self.session.get(url, **kwargs)
+
+            span.set(status=resp.status_code)
+            # Streamed bodies are read after the span ends, so their callers record the bytes they read
+            if not kwargs.get('stream'):
+                span.set(bytes=len(resp.content))
+
+        return resp
 
     def make_dst_dir(self, username):
         """Creates the destination directory."""
@@ -96,38 +230,41 @@ class InstagramScraper(object):
             os.makedirs(dst)
         except OSError as err:
             if err.errno == errno.EEXIST and os.path.isdir(dst):
-                # Directory already exists
-                self.get_last_scraped_filemtime(dst)
-                pass
+                # Directory already exists, the newest file is only needed to find new media
+                if self.latest:
+                    self.get_last_scraped_filemtime(dst)
             else:
                 # Target dir exists as a file, or a different error
                 raise
 
         return dst
 
+    def get_dir_index(self, dst):
+        """Returns the contents index of a directory, scanning it on first use."""
+        with self.dir_indexes_lock:
+            if dst not in self.dir_indexes:
+                self.dir_indexes[dst] = DirectoryIndex(dst)
+            return self.dir_indexes[dst]
+
     def get_last_scraped_filemtime(self, dst):
         """Stores the last modified time of newest file in a directory."""
-        list_of_files = []
-        file_types = ('*.jpg', '*.mp4')
-
-        for type in file_types:
-            list_of_files.extend(glob.glob(dst + '/' + type))
+        latest_mtime = self.get_dir_index(dst).latest_mtime(('.jpg', '.mp4'))
 
-        if list_of_files:
-            latest_file = max(list_of_files, key=os.path.getmtime)
-            self.last_scraped_filemtime = int(os.path.getmtime(latest_file))
+        if latest_mtime is not None:
+            self.last_scraped_filemtime = int(latest_mtime)
 
     def is_new_media(self, item):
         """Returns True if the media is new."""
         return self.latest is False or self.last_scraped_filemtime == 0 or \
-               ('created_time' not in item and 'date' not in item) or \
-               (int(item.get('created_time', item.get('date'))) > self.last_scraped_filemtime)
+               item.timestamp is None or int(item.timestamp) > self.last_scraped_filemtime
 
     def __query(self, form_data, headers):
-        resp = self.session.post(QUERY_URL, data=form_data, headers=headers)
+        with self.tracer.span('query', 'request', url=QUERY_URL) as span:
+            resp = self.session.post(QUERY_URL, data=form_data, headers=headers)
+            span.set(status=resp.status_code, bytes=len(resp.content))
 
         if resp.status_code == 200:
-            media = json.loads(resp.text)['media']
+            media = parsing.loads(resp.content)['media']
             nodes = media['nodes']
             return self.__get_media_from_nodes(nodes), media['page_info']['end_cursor']
 
@@ -161,11 +298,13 @@ class InstagramScraper(object):
 
     def __query_media_gen(self, url, value, root_field, query_fn):
         """Generator for query media."""
-        resp = self.session.get(url.format(value))
+        with self.tracer.span('explore', 'request', url=url.format(value)) as span:
+            resp = self.session.get(url.format(value))
+            span.set(status=resp.status_code, bytes=len(resp.content))
 
         if resp.status_code == 200:
             csrf_token = resp.cookies['csrftoken']
-            obj = json.loads(resp.text)[root_field]
+            obj = parsing.loads(resp.content)[root_field]
 
             media = self.__get_media_from_nodes(obj['media']['nodes'])
             end_cursor = obj['media']['page_info']['end_cursor']
@@ -193,55 +332,62 @@ class InstagramScraper(object):
 
     def __get_media_from_nodes(self, nodes):
         """Fetches the media urls."""
+        media = []
         for node in nodes:
             if node['is_video']:
-                r = self.session.get(VIEW_MEDIA_URL.format(node['code']))
+                r = self.get(VIEW_MEDIA_URL.format(node['code']), url_class='view_media')
                 if r.status_code == 200:
-                    node['urls'] = [json.loads(r.text)['graphql']['shortcode_media']['video_url']]
+                    node['urls'] = [parsing.loads(r.content)['graphql']['shortcode_media']['video_url']]
                     self.extract_tags(node)
                 else:
                     self.logger.warn('Failed to get video url for hashtag')
             else:
                 node['urls'] = [self.get_original_image(node['display_src'])]
                 self.extract_tags(node)
-        return nodes
+            media.append(MediaItem.from_raw(node, 'date', keep_raw=self.media_metadata))
+        return media
 
-    def __scrape_query(self, media_generator, executor=concurrent.futures.ThreadPoolExecutor(max_workers=10)):
+    def __scrape_query(self, media_generator, executor=concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS)):
         """Scrapes the specified value for posted media."""
-        for value in self.usernames:
-            self.posts = []
-            self.last_scraped_filemtime = 0
-            future_to_item = {}
-
-            dst = self.make_dst_dir(value)
+        self.tracer.start()
 
-            iter = 0
-            for item in tqdm.tqdm(media_generator(value), desc='Searching {0} for posts'.format(value), unit=" media",
-                                  disable=self.quiet):
-                if ((item['is_video'] is False and 'image' in self.media_types) or \
-                    (item['is_video'] is True and 'video' in self.media_types)
-                ) and self.is_new_media(item):
-                    future = executor.submit(self.download, item, dst)
-                    future_to_item[future] = item
-
-                if self.media_metadata:
-                    self.posts.append(item)
-
-                iter = iter + 1
-                if self.maximum != 0 and iter >= self.maximum:
-                    break
-            
-            if future_to_item:
-                for future in tqdm.tqdm(concurrent.futures.as_completed(future_to_item), total=len(future_to_item),
-                                        desc='Downloading', disable=self.quiet):
-                    item = future_to_item[future]
+        try:
+            for value in self.usernames:
+                self.last_scraped_filemtime = 0
+                future_to_item = {}
 
-                    if future.exception() is not None:
-                        self.logger.warning(
-                            'Media for {0} at {1} generated an exception: {2}'.format(value, item['urls'], future.exception()))
+                self.tracer.set_target(value)
+                dst = self.make_dst_dir(value)
+                metadata = JsonStreamWriter('{0}/{1}.json'.format(dst, value))
 
-            if self.media_metadata and self.posts:
-                self.save_json(self.posts, '{0}/{1}.json'.format(dst, value))
+                try:
+                    with self.tracer.span('get_media'):
+                        iter = 0
+                        for item in tqdm.tqdm(media_generator(value), desc='Searching {0} for posts'.format(value),
+                                              unit=" media", disable=self.quiet):
+                            if self.in_media_types(item) and self.is_new_media(item):
+                                future = executor.submit(self.download, item, dst)
+                                future_to_item[future] = item
+
+                            self.save_metadata(metadata, item)
+
+                            iter = iter + 1
+                            if self.maximum != 0 and iter >= self.maximum:
+                                break
+
+                    if future_to_item:
+                        with self.tracer.span('download_wait', items=len(future_to_item)):
+                            for future in tqdm.tqdm(concurrent.futures.as_completed(future_to_item),
+                                                    total=len(future_to_item), desc='Downloading', disable=self.quiet):
+                                item = future_to_item[future]
+
+                                if future.exception() is not None:
+                                    self.logger.warning('Media for {0} at {1} generated an exception: {2}'.format(
+                                        value, item.urls, future.exception()))
+                finally:
+                    metadata.close()
+        finally:
+            self.tracer.stop()
 
     def scrape_hashtag(self):
         self.__scrape_query(self.media_gen_hashtag)
@@ -249,51 +395,62 @@ class InstagramScraper(object):
     def scrape_location(self):
         self.__scrape_query(self.media_gen_location)
 
-    def scrape(self, executor=concurrent.futures.ThreadPoolExecutor(max_workers=10)):
+    def scrape(self, executor=concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS)):
         """Crawls through and downloads user's media"""
-        if self.login_user and self.login_pass:
-            self.login()
-
-        for username in self.usernames:
-            self.posts = []
-            self.last_scraped_filemtime = 0
-            future_to_item = {}
-
-            dst = self.make_dst_dir(username)
-
-            # Get the user metadata.
-            user = self.fetch_user(username)
+        self.tracer.start()
 
-            if user:
-                self.get_profile_pic(dst, executor, future_to_item, user, username)
-                self.get_stories(dst, executor, future_to_item, user, username)
-
-            # Crawls the media and sends it to the executor.
-            self.get_media(dst, executor, future_to_item, username)
-
-            # Displays the progress bar of completed downloads. Might not even pop up if all media is downloaded while
-            # the above loop finishes.
-            if future_to_item:
-                for future in tqdm.tqdm(concurrent.futures.as_completed(future_to_item), total=len(future_to_item),
-                                        desc='Downloading', disable=self.quiet):
-                    item = future_to_item[future]
+        try:
+            if (self.login_user and self.login_pass) or self.credentials_file:
+                self.login()
 
-                    if future.exception() is not None:
-                        self.logger.warning(
-                            'Media at {0} generated an exception: {1}'.format(item['urls'], future.exception()))
+            for username in self.usernames:
+                self.last_scraped_filemtime = 0
+                future_to_item = {}
 
-            if self.media_metadata and self.posts:
-                self.save_json(self.posts, '{0}/{1}.json'.format(dst, username))
+                self.tracer.set_target(username)
+                dst = self.make_dst_dir(username)
+                metadata = JsonStreamWriter('{0}/{1}.json'.format(dst, username))
 
-        self.logout()
+                try:
+                    # Get the user metadata.
+                    with self.tracer.span('fetch_user'):
+                        user = self.fetch_user(username)
+
+                    if user:
+                        self.get_profile_pic(dst, executor, future_to_item, user, username)
+                        with self.tracer.span('get_stories'):
+                            self.get_stories(dst, executor, future_to_item, user, username)
+
+                    # Crawls the media and sends it to the executor.
+                    with self.tracer.span('get_media'):
+                        self.get_media(dst, executor, future_to_item, username, metadata)
+
+                    # Displays the progress bar of completed downloads. Might not even pop up if all media is downloaded
+                    # while the above loop finishes.
+                    if future_to_item:
+                        with self.tracer.span('download_wait', items=len(future_to_item)):
+                            for future in tqdm.tqdm(concurrent.futures.as_completed(future_to_item),
+                                                    total=len(future_to_item), desc='Downloading', disable=self.quiet):
+                                item = future_to_item[future]
+
+                                if future.exception() is not None:
+                                    self.logger.warning('Media at {0} generated an exception: {1}'.format(
+                                        item.urls, future.exception()))
+                finally:
+                    metadata.close()
+
+            self.logout()
+        finally:
+            self.tracer.stop()
 
     def get_profile_pic(self, dst, executor, future_to_item, user, username):
         # Download the profile pic if not the default.
         if 'image' in self.media_types and 'profile_pic_url_hd' in user \
                 and '11906329_960233084022564_1448528159' not in user['profile_pic_url_hd']:
-            item = {'urls': [re.sub(r'/s\d{3,}x\d{3,}/', '/', user['profile_pic_url_hd'])], 'created_time': 1286323200}
+            item = MediaItem(type='image', urls=[re.sub(r'/s\d{3,}x\d{3,}/', '/', user['profile_pic_url_hd'])],
+                             timestamp=1286323200)
 
-            if self.latest is False or os.path.isfile(dst + '/' + item['urls'][0].split('/')[-1]) is False:
+            if self.latest is False or item.urls[0].split('/')[-1] not in self.get_dir_index(dst):
                 for item in tqdm.tqdm([item], desc='Searching {0} for profile pic'.format(username), unit=" images",
                                       ncols=0, disable=self.quiet):
                     future = executor.submit(self.download, item, dst)
@@ -316,7 +473,7 @@ class InstagramScraper(object):
                 if self.maximum != 0 and iter >= self.maximum:
                     break
 
-    def get_media(self, dst, executor, future_to_item, username):
+    def get_media(self, dst, executor, future_to_item, username, metadata=None):
         """Scrapes the user's posts for media."""
         iter = 0
         for item in tqdm.tqdm(self.media_gen(username), desc='Searching {0} for posts'.format(username),
@@ -325,8 +482,7 @@ class InstagramScraper(object):
                 future = executor.submit(self.download, item, dst)
                 future_to_item[future] = item
 
-            if self.media_metadata:
-                self.posts.append(item)
+            self.save_metadata(metadata, item)
 
             iter = iter + 1
             if self.maximum != 0 and iter >= self.maximum:
@@ -334,26 +490,41 @@ class InstagramScraper(object):
 
     def fetch_user(self, username):
         """Fetches the user's metadata."""
-        resp = self.session.get(BASE_URL + username)
+        url = BASE_URL + username
+        resp = self.get(url, url_class='profile', stream=True)
+        read = [0]
 
-        if resp.status_code == 200 and '_sharedData' in resp.text:
-            try:
-                shared_data = resp.text.split("window._sharedData = ")[1].split(";</script>")[0]
-                return json.loads(shared_data)['entry_data']['ProfilePage'][0]['user']
-            except (TypeError, KeyError, IndexError):
-                pass
+        def counted(chunks):
+            for chunk in chunks:
+                read[0] += len(chunk)
+                yield chunk
+
+        try:
+            if resp.status_code == 200:
+                with self.tracer.span('profile_read', 'request', url=url) as span:
+                    try:
+                        chunks = counted(resp.iter_content(parsing.SHARED_DATA_CHUNK_SIZE))
+                        shared_data = parsing.find_shared_data(chunks)
+                    finally:
+                        span.set(bytes=read[0])
+                return shared_data['entry_data']['ProfilePage'][0]['user']
+        except (TypeError, KeyError, IndexError, ValueError):
+            pass
+        finally:
+            resp.close()
 
     def fetch_stories(self, user_id):
         """Fetches the user's stories."""
-        resp = self.session.get(STORIES_URL.format(user_id), headers={
+        resp = self.get(STORIES_URL.format(user_id), url_class='stories', account_headers=lambda account: {
             'user-agent' : STORIES_UA,
-            'cookie'     : STORIES_COOKIE.format(self.cookies['ds_user_id'], self.cookies['sessionid'])
+            'cookie'     : STORIES_COOKIE.format(account.cookies['ds_user_id'], account.cookies['sessionid'])
         })
 
-        retval = json.loads(resp.text)
+        retval = parsing.loads(resp.content)
 
         if resp.status_code == 200 and 'items' in retval and len(retval['items']) > 0:
-            return [self.set_story_url(item) for item in retval['items']]
+            return [MediaItem.from_raw(self.set_story_url(item), 'taken_at', keep_raw=False)
+                    for item in retval['items']]
         return []
 
     def media_gen(self, username):
@@ -366,7 +537,7 @@ class InstagramScraper(object):
                     yield item
 
                 if media.get('more_available') and self.is_new_media(media['items'][-1]):
-                    max_id = media['items'][-1]['id']
+                    max_id = media['items'][-1].id
                     media = self.fetch_media_json(username, max_id)
                 else:
                     return
@@ -380,10 +551,10 @@ class InstagramScraper(object):
         if max_id is not None:
             url += '?&max_id=' + max_id
 
-        resp = self.session.get(url)
+        resp = self.get(url, url_class='media_page')
 
         if resp.status_code == 200:
-            media = json.loads(resp.text)
+            media = parsing.loads(resp.content)
 
             if not media['items']:
                 raise ValueError('User {0} is private'.format(username))
@@ -394,20 +565,17 @@ class InstagramScraper(object):
             raise ValueError('User {0} does not exist'.format(username))
 
     def in_media_types(self, item):
-        if item['type'] == 'carousel':
-            for carousel_item in item['carousel_media']:
-                if carousel_item['type'] in self.media_types:
-                    return True
-        else:
-            return item['type'] in self.media_types
+        for media_type in item.types:
+            if media_type in self.media_types:
+                return True
 
         return False
 
     def augment_media_item(self, item):
-        """Augments media item object with new properties."""
+        """Augments media item object with new properties and returns its compact record."""
         self.get_media_urls(item)
         self.extract_tags(item)
-        return item
+        return MediaItem.from_raw(item, 'created_time', keep_raw=self.media_metadata)
 
     def get_media_urls(self, item):
         """Sets the media url."""
@@ -454,29 +622,150 @@ class InstagramScraper(object):
 
     def download(self, item, save_dir='./'):
         """Downloads the media file."""
-        for url in item['urls']:
+        dir_index = self.get_dir_index(save_dir)
+
+        for url in item.urls:
             base_name = url.split('/')[-1]
             file_path = os.path.join(save_dir, base_name)
 
-            if not os.path.isfile(file_path):
-                with open(file_path, 'wb') as media_file:
-                    try:
-                        content = self.session.get(url).content
-                    except requests.exceptions.ConnectionError:
-                        time.sleep(5)
-                        content = requests.get(url).content
-
-                    media_file.write(content)
+            if base_name not in dir_index:
+                queued_at = time.time()
+                with self.connection_slots:
+                    # Time spent waiting for a slot is not the host's, so it is kept out of the span duration
+                    with self.tracer.span('download', 'request', url=url) as span:
+                        span.set(slot_wait_ms=int((time.time() - queued_at) * 1000))
+                        size = self.download_file(url, file_path)
+                        span.set(bytes=size)
 
-                file_time = int(item.get('created_time', item.get('taken_at', item.get('date', time.time()))))
+                file_time = int(item.timestamp if item.timestamp is not None else time.time())
                 os.utime(file_path, (file_time, file_time))
+                dir_index.add(base_name, size, file_time)
+
+    def download_file(self, url, file_path):
+        """Downloads the url to a file, in parallel byte-range segments if it is large enough."""
+        resp = self.get_stream(url)
+        size = int(resp.headers.get('Content-Length') or 0)
+
+        # Only complete files get the real name, so an interrupted download is retried on the next run
+        part_path = file_path + '.part'
+
+        try:
+            if self.segments and self.segments > 1 and size >= self.segment_min_size \
+                    and resp.headers.get('Accept-Ranges') == 'bytes':
+                try:
+                    self.download_segments(resp, url, part_path, size)
+                except (ValueError, IOError, requests.exceptions.RequestException) as err:
+                    # Fall back to a single stream rather than lose a file the server can still send whole
+                    self.logger.warning('Segmented download of {0} failed, downloading it whole: {1}'.format(url, err))
+                    resp.close()
+                    resp = self.get_stream(url)
+                    size = self.write_stream(resp, part_path)
+            else:
+                size = self.write_stream(resp, part_path)
+        except Exception:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+        finally:
+            resp.close()
+
+        os.rename(part_path, file_path)
+        return size
+
+    def get_stream(self, url, headers=None):
+        """Opens a streamed GET of the url, retrying once if the connection fails."""
+        try:
+            return self.session.get(url, headers=headers, stream=True)
+        except requests.exceptions.ConnectionError:
+            time.sleep(5)
+            return requests.get(url, headers=headers, stream=True)
+
+    @staticmethod
+    def write_stream(resp, part_path):
+        """Streams the whole response into the part file and returns its size."""
+        size = 0
+        with open(part_path, 'wb') as part_file:
+            for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+                part_file.write(chunk)
+                size += len(chunk)
+        return size
+
+    def download_segments(self, resp, url, part_path, size):
+        """Fetches the file in byte-range segments written in place, reusing resp for the first one."""
+        segment_size = -(-size // self.segments)
+        ranges = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+        with open(part_path, 'wb') as part_file:
+            part_file.truncate(size)
+
+        # Extra segments only run on connection slots that are free right now, the rest are fetched in this thread
+        futures = []
+        pending = []
+        for start, end in ranges[1:]:
+            if self.connection_slots.acquire(False):
+                futures.append(self.segment_executor.submit(self.download_segment, url, part_path, start, end))
+            else:
+                pending.append((start, end))
+
+        try:
+            self.write_segment(resp, part_path, 0, ranges[0][1])
+            for start, end in pending:
+                self.fetch_segment(url, part_path, start, end)
+        finally:
+            for future in futures:
+                future.exception()
+
+        for future in futures:
+            future.result()
+
+    def download_segment(self, url, part_path, start, end):
+        """Fetches a segment on a connection slot acquired by the caller."""
+        try:
+            self.fetch_segment(url, part_path, start, end)
+        finally:
+            self.connection_slots.release()
+
+    def fetch_segment(self, url, part_path, start, end):
+        """Fetches a byte range into the part file, retrying once if the transfer fails."""
+        with self.tracer.span('download_segment', 'request', url=url, bytes=end - start + 1):
+            for attempt in range(2):
+                resp = self.get_stream(url, headers={'Range': 'bytes={0}-{1}'.format(start, end)})
+
+                if resp.status_code != 206:
+                    resp.close()
+                    raise ValueError('Range request for {0} returned {1}'.format(url, resp.status_code))
+
+                try:
+                    self.write_segment(resp, part_path, start, end)
+                    return
+                except (ValueError, IOError, requests.exceptions.RequestException):
+                    if attempt:
+                        raise
 
     @staticmethod
-    def save_json(data, dst='./'):
-        """Saves the data to a json file."""
-        if data:
-            with open(dst, 'wb') as f:
-                json.dump(data, codecs.getwriter('utf-8')(f), indent=4, sort_keys=True, ensure_ascii=False)
+    def write_segment(resp, part_path, start, end):
+        """Streams the response into the part file at the segment offset."""
+        remaining = end - start + 1
+
+        with open(part_path, 'r+b') as part_file:
+            part_file.seek(start)
+            for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+                part_file.write(chunk[:remaining])
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    break
+        resp.close()
+
+        if remaining > 0:
+            raise ValueError('Segment {0}-{1} of {2} ended early'.format(start, end, resp.url))
+
+    def save_metadata(self, metadata, item):
+        """Streams the raw item out to the metadata file and releases it."""
+        if self.media_metadata and metadata is not None and item.raw is not None:
+            metadata.write(item.raw)
+        item.raw = None
 
     @staticmethod
     def get_logger(level=logging.WARNING, log_file='instagram-scraper.log'):
@@ -508,6 +797,27 @@ class InstagramScraper(object):
 
         return users
 
+    @staticmethod
+    def parse_credentials_file(credentials_file):
+        """Parses a file containing one username:password login per line."""
+        credentials = []
+
+        try:
+            with open(credentials_file) as creds_file:
+                for line_number, line in enumerate(creds_file.readlines(), 1):
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        user, sep, password = line.partition(':')
+                        if not sep or not user or not password:
+                            # Don't echo the line, it may hold a password
+                            raise ValueError('Invalid login on line {0} of {1}, expected username:password'.format(
+                                line_number, credentials_file))
+                        credentials.append((user, password))
+        except IOError as err:
+            raise ValueError('File not found ' + str(err))
+
+        return credentials
+
     @staticmethod
     def parse_delimited_str(input):
         """Parse the string input as a list of delimited tokens."""
@@ -537,6 +847,8 @@ def main():
     parser.add_argument('--destination', '-d', default='./', help='Download destination')
     parser.add_argument('--login_user', '-u', default=None, help='Instagram login user')
     parser.add_argument('--login_pass', '-p', default=None, help='Instagram login password')
+    parser.add_argument('--credentials_file', default=None,
+                        help='Path to a file of username:password logins to spread requests across')
     parser.add_argument('--filename', '-f', help='Path to a file containing a list of users to scrape')
     parser.add_argument('--quiet', '-q', default=False, action='store_true', help='Be quiet while scraping')
     parser.add_argument('--maximum', '-m', type=int, default=0, help='Maximum number of items to scrape')
@@ -545,6 +857,12 @@ def main():
     parser.add_argument('--media_metadata', action='store_true', default=False, help='Save media metadata to json file')
     parser.add_argument('--media_types', '-t', nargs='+', default=['image', 'video', 'story'], help='Specify media types to scrape')
     parser.add_argument('--latest', action='store_true', default=False, help='Scrape new media since the last scrape')
+    parser.add_argument('--segments', type=int, default=DOWNLOAD_SEGMENTS,
+                        help='Number of parallel byte-range segments for large downloads')
+    parser.add_argument('--trace', default=None, metavar='DIR',
+                        help='Save a chrome trace of the run\'s requests and stages to this directory')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='Also save a cProfile of the run next to the trace')
     parser.add_argument('--tag', action='store_true', default=False, help='Scrape media using a hashtag')
     parser.add_argument('--location', action='store_true', default=False, help='Scrape media using a location')
 
@@ -573,6 +891,10 @@ def main():
     if args.media_types and len(args.media_types) == 1 and re.compile(r'[,;\s]+').findall(args.media_types[0]):
         args.media_types = InstagramScraper.parse_delimited_str(args.media_types[0])
 
+    if args.profile and args.trace is None:
+        parser.print_help()
+        raise ValueError('Must provide a --trace directory to save the profile to')
+
     scraper = InstagramScraper(**vars(args))
 
     if args.tag:
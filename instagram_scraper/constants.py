@@ -76,4 +76,9 @@ QUERY_LOCATION = ' '.join("""
                 page_info
         }
     }
-    """.split())
\ No newline at end of file
+    """.split())
+
+MAX_CONCURRENT_DOWNLOADS = 10
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+SEGMENTED_DOWNLOAD_MIN_SIZE = 8 * 1024 * 1024
+DOWNLOAD_SEGMENTS = 4
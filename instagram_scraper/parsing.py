@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+
+try:
+    import orjson as json_backend
+except ImportError:
+    try:
+        import ujson as json_backend
+    except ImportError:
+        json_backend = json
+
+SHARED_DATA_START = b'window._sharedData = '
+SHARED_DATA_END = b';</script>'
+SHARED_DATA_MAX_BYTES = 8 * 1024 * 1024
+SHARED_DATA_CHUNK_SIZE = 64 * 1024
+
+# The stdlib json only accepts bytes from Python 3.6 onwards
+DECODE_BYTES = json_backend is json and (3, 0) <= sys.version_info < (3, 6)
+
+
+def loads(data):
+    """Decodes json straight from response bytes using the fastest available backend."""
+    if DECODE_BYTES and isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json_backend.loads(data)
+
+
+def find_shared_data(chunks, max_bytes=SHARED_DATA_MAX_BYTES):
+    """Scans chunks of a profile page for the window._sharedData blob and decodes it.
+
+    Returns None if the blob is not found within the first max_bytes of the page.
+    """
+    buf = bytearray()
+    found = False
+    pos = 0
+    scanned = 0
+
+    for chunk in chunks:
+        scanned += len(chunk)
+        buf.extend(chunk)
+
+        if not found:
+            start = buf.find(SHARED_DATA_START)
+            if start == -1:
+                # Keep just enough of the tail to match a marker split across chunks
+                del buf[:max(0, len(buf) - len(SHARED_DATA_START) + 1)]
+            else:
+                del buf[:start + len(SHARED_DATA_START)]
+                found = True
+
+        if found:
+            end = buf.find(SHARED_DATA_END, pos)
+            if end != -1:
+                return loads(bytes(buf[:end]))
+            pos = max(0, len(buf) - len(SHARED_DATA_END) + 1)
+
+        if scanned >= max_bytes:
+            break
+
+    return None
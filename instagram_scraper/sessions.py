@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+import time
+
+import requests
+import tqdm
+
+from instagram_scraper import parsing
+from instagram_scraper.constants import *
+from instagram_scraper.tracing import NULL_SPAN
+
+# Seconds an account is kept out of rotation after a rate limit or challenge
+ACCOUNT_COOLDOWN = 10 * 60
+
+
+class Account(object):
+    """An instagram login with its own session, cookies and rate state."""
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.session = requests.Session()
+        self.cookies = None
+        self.logged_in = False
+        self.available_at = 0
+
+    def login(self):
+        """Logs in to instagram."""
+        self.session.headers.update({'Referer': BASE_URL})
+        req = self.session.get(BASE_URL)
+
+        self.session.headers.update({'X-CSRFToken': req.cookies['csrftoken']})
+
+        login_data = {'username': self.username, 'password': self.password}
+        login = self.session.post(LOGIN_URL, data=login_data, allow_redirects=True)
+        self.session.headers.update({'X-CSRFToken': login.cookies['csrftoken']})
+        self.cookies = login.cookies
+
+        if login.status_code == 200 and parsing.loads(login.content)['authenticated']:
+            self.logged_in = True
+        else:
+            raise ValueError('Login failed for ' + self.username)
+
+    def logout(self):
+        """Logs out of instagram."""
+        if self.logged_in:
+            logout_data = {'csrfmiddlewaretoken': self.cookies['csrftoken']}
+            self.session.post(LOGOUT_URL, data=logout_data)
+            self.logged_in = False
+
+
+class SessionPool(object):
+    """Spreads logged-in requests across the healthy accounts of a pool."""
+    def __init__(self, accounts, logger, cooldown=ACCOUNT_COOLDOWN):
+        self.accounts = list(accounts)
+        self.logger = logger
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.next_index = 0
+
+    def login(self):
+        """Logs in every account, dropping the ones that fail."""
+        for account in self.accounts:
+            try:
+                account.login()
+            except (ValueError, KeyError, requests.exceptions.RequestException):
+                self.logger.exception('Login failed for ' + account.username)
+
+        self.accounts = [account for account in self.accounts if account.logged_in]
+        if not self.accounts:
+            raise ValueError('Login failed for all accounts')
+
+    def logout(self):
+        for account in self.accounts:
+            try:
+                account.logout()
+            except requests.exceptions.RequestException:
+                self.logger.warning('Failed to log out ' + account.username)
+
+    def acquire(self):
+        """Returns the next account in rotation, waiting for one to cool down if all are benched."""
+        with self.lock:
+            now = time.time()
+            for offset in range(len(self.accounts)):
+                account = self.accounts[(self.next_index + offset) % len(self.accounts)]
+                if account.available_at <= now:
+                    self.next_index = (self.next_index + offset + 1) % len(self.accounts)
+                    return account
+
+            account = min(self.accounts, key=lambda a: a.available_at)
+
+        wait = max(0, account.available_at - time.time())
+        message = 'All accounts are rate limited, waiting {0:.0f}s for {1}'.format(wait, account.username)
+        self.logger.warning(message)
+        tqdm.tqdm.write(message, file=sys.stderr)
+        time.sleep(wait)
+        return account
+
+    def bench(self, account):
+        """Takes an account out of rotation for the cooldown period."""
+        with self.lock:
+            account.available_at = time.time() + self.cooldown
+        self.logger.warning('Account {0} is rate limited or challenged, resting for {1}s'.format(
+            account.username, self.cooldown))
+
+    @staticmethod
+    def is_limited(resp):
+        """Returns True if the response is a rate limit or a login challenge."""
+        if resp.status_code == 429:
+            return True
+        if resp.status_code in (400, 403):
+            return b'checkpoint_required' in resp.content or b'challenge' in resp.content
+        return False
+
+    def request(self, method, url, account_headers=None, span=NULL_SPAN, **kwargs):
+        """Sends a request through the next healthy account, moving on to another one if it is limited.
+
+        The account used, the number of attempts and the time spent waiting for a rested account are set on span.
+        """
+        if len(self.accounts) == 1:
+            # There is no other account to move on to, so a limited response is returned as a single login would
+            account = self.accounts[0]
+            if account_headers is not None:
+                kwargs['headers'] = account_headers(account)
+            span.set(account=account.username, attempts=1, cooldown_wait_ms=0)
+            return account.session.request(method, url, **kwargs)
+
+        attempts = len(self.accounts) + 1
+        waited = 0
+
+        for attempt in range(attempts):
+            acquire_start = time.time()
+            account = self.acquire()
+            waited += time.time() - acquire_start
+            span.set(account=account.username, attempts=attempt + 1, cooldown_wait_ms=int(waited * 1000))
+
+            if account_headers is not None:
+                kwargs['headers'] = account_headers(account)
+
+            resp = account.session.request(method, url, **kwargs)
+
+            if self.is_limited(resp):
+                self.bench(account)
+                if attempt < attempts - 1:
+                    resp.close()
+                    continue
+
+            return resp
@@ -2,9 +2,14 @@ import unittest
 import os
 import shutil
 import tempfile
+import requests
 import requests_mock
 import glob
-from instagram_scraper import InstagramScraper
+import json
+from instagram_scraper import InstagramScraper, parsing
+from instagram_scraper.app import DirectoryIndex, MediaItem
+from instagram_scraper.sessions import Account, SessionPool
+from instagram_scraper.tracing import Tracer
 from instagram_scraper.constants import *
 
 class InstagramTests(unittest.TestCase):
@@ -87,3 +92,273 @@ class InstagramTests(unittest.TestCase):
 
             self.assertEqual(open(os.path.join(self.test_dir, 'video.mp4')).read(),
                              "video")
+
+    def test_scrape_media_metadata(self):
+        self.scraper.media_metadata = True
+
+        with requests_mock.Mocker() as m:
+            m.get(BASE_URL + self.scraper.usernames[0], text=self.response_user_metadata)
+            m.get(MEDIA_URL.format(self.scraper.usernames[0]), text=self.response_first_page)
+            m.get(MEDIA_URL.format(self.scraper.usernames[0]) + '?max_id=' + self.max_id,
+                  text=self.response_second_page)
+            m.get('https://fake-url.com/photo1.jpg', text="image1")
+            m.get('https://fake-url.com/photo2.jpg', text="image2")
+            m.get('https://fake-url.com/photo3.jpg', text="image3")
+
+            self.scraper.scrape()
+
+            with open(os.path.join(self.test_dir, 'test.json')) as f:
+                posts = json.load(f)
+
+            self.assertEqual([post['urls'] for post in posts],
+                             [['https://fake-url.com/photo1.jpg'], ['https://fake-url.com/photo2.jpg'],
+                              ['https://fake-url.com/photo3.jpg']])
+
+    def test_fetch_user(self):
+        html = ('<html><body><script type="text/javascript">window._sharedData = ' +
+                self.response_user_metadata + ';</script></body></html>').encode('utf-8')
+
+        with requests_mock.Mocker() as m:
+            m.get(BASE_URL + self.scraper.usernames[0], content=html)
+
+            user = self.scraper.fetch_user(self.scraper.usernames[0])
+
+        self.assertEqual(user['username'], 'instagram')
+
+        # The markers may be split across chunk boundaries.
+        chunks = [html[i:i + 7] for i in range(0, len(html), 7)]
+        shared_data = parsing.find_shared_data(chunks)
+        self.assertEqual(shared_data['entry_data']['ProfilePage'][0]['user']['username'], 'instagram')
+        self.assertEqual(parsing.find_shared_data(chunks, max_bytes=32), None)
+
+    def test_scrape_skips_existing(self):
+        with open(os.path.join(self.test_dir, 'photo3.jpg'), 'w') as f:
+            f.write("existing")
+
+        with requests_mock.Mocker() as m:
+            m.get(BASE_URL + self.scraper.usernames[0], text=self.response_user_metadata)
+            m.get(MEDIA_URL.format(self.scraper.usernames[0]), text=self.response_first_page)
+            m.get(MEDIA_URL.format(self.scraper.usernames[0]) + '?max_id=' + self.max_id,
+                  text=self.response_second_page)
+            m.get('https://fake-url.com/photo1.jpg', text="image1")
+            m.get('https://fake-url.com/photo2.jpg', text="image2")
+            m.get('https://fake-url.com/photo3.jpg', text="image3")
+
+            self.scraper.scrape()
+
+            self.assertEqual(open(os.path.join(self.test_dir, 'photo3.jpg')).read(), "existing")
+            self.assertEqual(open(os.path.join(self.test_dir, 'photo1.jpg')).read(), "image1")
+            self.assertEqual(os.path.getsize(os.path.join(self.test_dir, 'photo1.jpg')),
+                             self.scraper.get_dir_index(self.test_dir).entries['photo1.jpg'][0])
+            self.assertFalse(any(req.url.endswith('photo3.jpg') for req in m.request_history))
+
+    def test_directory_index_latest_mtime(self):
+        for name, mtime in (('old.jpg', 1000), ('new.mp4', 2000), ('newest.json', 3000)):
+            path = os.path.join(self.test_dir, name)
+            open(path, 'w').close()
+            os.utime(path, (mtime, mtime))
+
+        index = DirectoryIndex(self.test_dir)
+
+        # Scanning only reads names, mtimes are read when asked for
+        self.assertEqual(index.entries, {'old.jpg': None, 'new.mp4': None, 'newest.json': None})
+        self.assertEqual(index.latest_mtime(('.jpg', '.mp4')), 2000)
+        self.assertEqual(index.entries['new.mp4'], (0, 2000))
+
+    def test_session_pool_rotation(self):
+        credentials_file = os.path.join(self.test_dir, 'credentials.txt')
+        with open(credentials_file, 'w') as f:
+            f.write('# logins\nuser1:pass1\n\nuser2:pass2\n')
+
+        self.scraper.credentials_file = credentials_file
+
+        with requests_mock.Mocker() as m:
+            m.get(BASE_URL, text='', cookies={'csrftoken': 'token'})
+            m.post(LOGIN_URL, text='{"authenticated": true}', cookies={'csrftoken': 'token'})
+            m.get(MEDIA_URL.format('test'), [
+                {'text': 'Please wait a few minutes', 'status_code': 429},
+                {'text': self.response_first_page, 'status_code': 200}
+            ])
+
+            self.scraper.login()
+            self.scraper.tracer = Tracer(self.test_dir)
+            user1, user2 = self.scraper.accounts.accounts
+
+            # user1 gets rate limited, so the request is retried with user2
+            media = self.scraper.fetch_media_json('test', max_id=None)
+            self.assertEqual(len(media['items']), 2)
+            self.assertTrue(user1.available_at > 0)
+            self.assertEqual(user2.available_at, 0)
+
+            span_args = self.scraper.tracer.events[-1]['args']
+            self.assertEqual((span_args['account'], span_args['attempts'], span_args['cooldown_wait_ms']),
+                             ('user2', 2, 0))
+
+            # user1 stays out of rotation while it cools down
+            self.assertTrue(self.scraper.accounts.acquire() is user2)
+            self.assertTrue(self.scraper.accounts.acquire() is user2)
+
+    def test_segmented_download(self):
+        self.scraper.segments = 3
+        self.scraper.segment_min_size = 10
+        video = b''.join(str(i).encode('ascii') for i in range(100))
+
+        def respond(request, context):
+            context.headers['Accept-Ranges'] = 'bytes'
+            if 'Range' in request.headers:
+                start, end = [int(i) for i in request.headers['Range'].split('=')[1].split('-')]
+                context.status_code = 206
+                return video[start:end + 1]
+            context.headers['Content-Length'] = str(len(video))
+            return video
+
+        with requests_mock.Mocker() as m:
+            m.get('https://fake-url.com/video.mp4', content=respond)
+
+            self.scraper.download(MediaItem(type='video', urls=['https://fake-url.com/video.mp4'], timestamp=1),
+                                  self.test_dir)
+
+            ranges = [req.headers.get('Range') for req in m.request_history]
+
+        with open(os.path.join(self.test_dir, 'video.mp4'), 'rb') as f:
+            self.assertEqual(f.read(), video)
+        self.assertEqual(sorted(ranges[1:]), ['bytes=128-189', 'bytes=64-127'])
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, 'video.mp4.part')))
+
+    def test_scrape_trace(self):
+        trace_dir = os.path.join(self.test_dir, 'trace')
+        self.scraper = InstagramScraper(usernames=['test'], destination=self.test_dir, quiet=True,
+                                        trace=trace_dir, profile=True)
+
+        with requests_mock.Mocker() as m:
+            m.get(BASE_URL + self.scraper.usernames[0], text=self.response_user_metadata)
+            m.get(MEDIA_URL.format(self.scraper.usernames[0]), text=self.response_first_page)
+            m.get(MEDIA_URL.format(self.scraper.usernames[0]) + '?max_id=' + self.max_id,
+                  text=self.response_second_page)
+            m.get('https://fake-url.com/photo1.jpg', text="image1")
+            m.get('https://fake-url.com/photo2.jpg', text="image2")
+            m.get('https://fake-url.com/photo3.jpg', text="image3")
+
+            self.scraper.scrape()
+
+        trace_file = os.path.join(trace_dir, 'instagram-scraper-' + self.scraper.tracer.run_id + '.trace.json')
+        self.assertTrue(os.path.isfile(trace_file.replace('.trace.json', '.prof')))
+        with open(trace_file) as f:
+            events = json.load(f)['traceEvents']
+
+        spans = [event for event in events if event['ph'] == 'X']
+        self.assertEqual(sorted(set(span['name'] for span in spans)),
+                         ['download', 'download_wait', 'fetch_user', 'get_media', 'media_page', 'profile',
+                          'profile_read'])
+        self.assertTrue(all(span['args']['target'] == 'test' for span in spans))
+
+        downloads = [span for span in spans if span['name'] == 'download']
+        self.assertEqual(len(downloads), 3)
+        self.assertTrue(all(span['args']['host'] == 'fake-url.com' and span['args']['bytes'] == 6
+                            for span in downloads))
+        self.assertEqual(len([span for span in spans if span['name'] == 'media_page']), 2)
+
+        # The profile page is streamed, so its size comes from the bytes actually read
+        profile_read = [span for span in spans if span['name'] == 'profile_read'][0]
+        self.assertEqual(profile_read['args']['bytes'], len(self.response_user_metadata.encode('utf-8')))
+
+    def test_failed_download_leaves_no_file(self):
+        class BrokenBody(object):
+            def __init__(self):
+                self.reads = 0
+
+            def read(self, *args, **kwargs):
+                self.reads += 1
+                if self.reads > 1:
+                    raise IOError('connection reset')
+                return b'partial'
+
+        with requests_mock.Mocker() as m:
+            m.get('https://fake-url.com/photo1.jpg', body=BrokenBody())
+
+            self.assertRaises(Exception, self.scraper.download,
+                              MediaItem(urls=['https://fake-url.com/photo1.jpg'], timestamp=1), self.test_dir)
+
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+    def test_segmented_download_ranges_ignored(self):
+        self.scraper.segments = 2
+        self.scraper.segment_min_size = 10
+        video = b'0123456789' * 10
+
+        with requests_mock.Mocker() as m:
+            # The server advertises ranges but answers every request with the whole file
+            m.get('https://fake-url.com/video.mp4', content=video,
+                  headers={'Content-Length': '100', 'Accept-Ranges': 'bytes'})
+
+            self.scraper.download(MediaItem(urls=['https://fake-url.com/video.mp4'], timestamp=1), self.test_dir)
+
+        with open(os.path.join(self.test_dir, 'video.mp4'), 'rb') as f:
+            self.assertEqual(f.read(), video)
+        self.assertEqual(os.listdir(self.test_dir), ['video.mp4'])
+
+    def test_segmented_download_retries_segment(self):
+        self.scraper.segments = 2
+        self.scraper.segment_min_size = 10
+        video = b'0123456789' * 10
+        range_requests = []
+
+        def respond(request, context):
+            context.headers['Accept-Ranges'] = 'bytes'
+            if 'Range' not in request.headers:
+                context.headers['Content-Length'] = str(len(video))
+                return video
+            range_requests.append(request.headers['Range'])
+            start, end = [int(i) for i in request.headers['Range'].split('=')[1].split('-')]
+            context.status_code = 206
+            # The first attempt at the range is cut short
+            return video[start:end + 1] if len(range_requests) > 1 else video[start:start + 5]
+
+        with requests_mock.Mocker() as m:
+            m.get('https://fake-url.com/video.mp4', content=respond)
+
+            self.scraper.download(MediaItem(urls=['https://fake-url.com/video.mp4'], timestamp=1), self.test_dir)
+
+        with open(os.path.join(self.test_dir, 'video.mp4'), 'rb') as f:
+            self.assertEqual(f.read(), video)
+        self.assertEqual(range_requests, ['bytes=50-99', 'bytes=50-99'])
+
+    def test_media_metadata_closed_on_error(self):
+        self.scraper.media_metadata = True
+        self.scraper.media_types = []
+
+        with requests_mock.Mocker() as m:
+            m.get(BASE_URL + self.scraper.usernames[0], text=self.response_user_metadata)
+            m.get(MEDIA_URL.format(self.scraper.usernames[0]), text=self.response_first_page)
+            m.get(MEDIA_URL.format(self.scraper.usernames[0]) + '?max_id=' + self.max_id,
+                  exc=requests.exceptions.ConnectionError)
+
+            self.assertRaises(requests.exceptions.ConnectionError, self.scraper.scrape)
+
+        # The posts streamed before the failure still form a valid json array
+        with open(os.path.join(self.test_dir, 'test.json')) as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+    def test_parse_credentials_file_hides_password(self):
+        credentials_file = os.path.join(self.test_dir, 'credentials.txt')
+        with open(credentials_file, 'w') as f:
+            f.write('user1:pass1\nuser2 secret\n')
+
+        try:
+            InstagramScraper.parse_credentials_file(credentials_file)
+            self.fail('Expected ValueError')
+        except ValueError as err:
+            self.assertTrue('line 2' in str(err))
+            self.assertFalse('secret' in str(err))
+
+    def test_session_pool_single_account(self):
+        account = Account('user1', 'pass1')
+        pool = SessionPool([account], self.scraper.logger)
+
+        with requests_mock.Mocker() as m:
+            m.get(MEDIA_URL.format('test'), text='Please wait a few minutes', status_code=429)
+
+            # With no other account to rotate to, the rate limit is returned without resting the account
+            self.assertEqual(pool.request('GET', MEDIA_URL.format('test')).status_code, 429)
+            self.assertEqual(account.available_at, 0)
+            self.assertEqual(len(m.request_history), 1)
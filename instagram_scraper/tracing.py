@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import cProfile
+import json
+import os
+import threading
+import time
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse  # Python 2.7
+
+
+class Span(object):
+    """A timed section of a run, recorded as a chrome trace complete event."""
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.args['error'] = repr(exc_value)
+        self.tracer.record(self, time.time())
+
+
+class NullSpan(object):
+    """Stands in for a span when tracing is disabled."""
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer(object):
+    """Records request and pipeline spans of a run and exports them as chrome trace-event json.
+
+    The trace can be opened in chrome://tracing or https://ui.perfetto.dev. When profile is set, a
+    cProfile of the main thread is saved next to the trace under the same run id.
+    """
+    def __init__(self, trace_dir=None, profile=False):
+        self.trace_dir = trace_dir
+        self.enabled = trace_dir is not None
+        self.profile = profile
+        self.run_id = '{0}-{1}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        self.target = None
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.profiler = None
+
+    def span(self, name, cat='stage', **args):
+        """Returns a context manager that records a span of the given name and category."""
+        if not self.enabled:
+            return NULL_SPAN
+
+        if 'target' not in args:
+            args['target'] = self.target
+        if 'url' in args:
+            args['host'] = urlparse(args['url']).netloc
+
+        return Span(self, name, cat, args)
+
+    def set_target(self, target):
+        """Sets the user, hashtag or location that following spans belong to."""
+        self.target = target
+
+    def record(self, span, end):
+        thread = threading.current_thread()
+        event = {
+            'name': span.name,
+            'cat': span.cat,
+            'ph': 'X',
+            'ts': int(span.start * 1000000),
+            'dur': int((end - span.start) * 1000000),
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': span.args
+        }
+
+        with self.lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    def start(self):
+        """Starts the run, and the profiler if requested."""
+        if self.enabled and self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        """Stops the profiler and exports the trace."""
+        if not self.enabled:
+            return
+
+        if not os.path.isdir(self.trace_dir):
+            os.makedirs(self.trace_dir)
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.get_path('.prof'))
+            self.profiler = None
+
+        self.export(self.get_path('.trace.json'))
+
+    def get_path(self, extension):
+        return os.path.join(self.trace_dir, 'instagram-scraper-' + self.run_id + extension)
+
+    def export(self, dst):
+        """Writes the recorded spans to a chrome trace-event json file."""
+        with self.lock:
+            metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                        for tid, name in self.threads.items()]
+            trace = {
+                'traceEvents': metadata + sorted(self.events, key=lambda event: event['ts']),
+                'displayTimeUnit': 'ms',
+                'otherData': {'run_id': self.run_id}
+            }
+
+        with open(dst, 'w') as f:
+            json.dump(trace, f)
@@ -11,6 +11,9 @@ requires = [
 if sys.version_info < (3, 2):
     requires.append('futures==2.2')
 
+if sys.version_info < (3, 5):
+    requires.append('scandir')
+
 setup(
     name='instagram-scraper',
     version='1.3.7',